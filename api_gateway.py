@@ -25,21 +25,58 @@ logger = logging.getLogger(__name__)
 VLLM_BASE_URL = os.getenv("VLLM_BASE_URL", "http://localhost:8080")
 SECRET_NAME = os.getenv("API_KEYS_SECRET_NAME", "vllm-api-keys")
 GCP_PROJECT = os.getenv("GCP_PROJECT")
+# Upstream connection pool sizing (tune for expected concurrent requests)
+GATEWAY_MAX_CONN = int(os.getenv("GATEWAY_MAX_CONN", "1000"))
+GATEWAY_KEEPALIVE = int(os.getenv("GATEWAY_KEEPALIVE", "200"))
+
+# Headers that must not be forwarded between client and vLLM (hop-by-hop headers,
+# plus X-API-Key and Host which httpx sets for the upstream connection)
+_HOP_BY_HOP = frozenset({
+    "x-api-key",
+    "host",
+    "connection",
+    "keep-alive",
+    "transfer-encoding",
+    "content-length",
+    "upgrade",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+})
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown lifecycle."""
     logger.info("Starting API Gateway...")
+    # Shared client so upstream connections are pooled and kept alive across requests
+    app.state.http_client = httpx.AsyncClient(
+        base_url=VLLM_BASE_URL,
+        timeout=httpx.Timeout(300.0),
+        limits=httpx.Limits(
+            max_connections=GATEWAY_MAX_CONN,
+            max_keepalive_connections=GATEWAY_KEEPALIVE,
+            keepalive_expiry=30.0,
+        ),
+        http2=False,  # vLLM serves HTTP/1.1
+    )
     yield
     logger.info("Shutting down API Gateway...")
+    await app.state.http_client.aclose()
 
 
 # Initialize FastAPI app
+# The gateway's own docs/OpenAPI routes are disabled: every proxied request is
+# matched against each route registered before the catch-all, and /docs and
+# /openapi.json should pass through to vLLM's OpenAI-compatible API docs anyway
 app = FastAPI(
     title="vLLM API Gateway",
     description="API key authentication layer for vLLM inference server",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    docs_url=None,
+    redoc_url=None,
+    openapi_url=None
 )
 
 
@@ -71,42 +108,59 @@ async def proxy_to_vllm(
     Returns:
         StreamingResponse with vLLM server response
     """
-    url = f"{VLLM_BASE_URL}/{path}"
+    client: httpx.AsyncClient = request.app.state.http_client
+
+    # Prepare headers (drop X-API-Key and hop-by-hop headers before forwarding)
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in _HOP_BY_HOP}
 
-    # Prepare headers (remove X-API-Key before forwarding)
-    headers = dict(request.headers)
-    headers.pop("x-api-key", None)
-    headers.pop("host", None)  # Let httpx set the correct host
+    # Forward the body as it arrives instead of buffering it. Content-Length is kept
+    # since the bytes are passed through unchanged, so the upstream request isn't
+    # re-framed as chunked; requests without a body (e.g. GET) are sent without one.
+    content = None
+    if "content-length" in request.headers:
+        headers["content-length"] = request.headers["content-length"]
+        content = request.stream()
+    elif "transfer-encoding" in request.headers:
+        content = request.stream()
 
     # Log request
-    logger.info(f"Proxying {request.method} {path} to vLLM")
+    logger.debug("Proxying %s %s to vLLM", request.method, path)
+
+    upstream_request = client.build_request(
+        method=request.method,
+        url=f"/{path}",
+        content=content,
+        headers=headers,
+        params=request.query_params,
+    )
 
     try:
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            # Forward request to vLLM
-            response = await client.request(
-                method=request.method,
-                url=url,
-                content=await request.body(),
-                headers=headers,
-                params=request.query_params,
-            )
-
-            # Return streaming response
-            return StreamingResponse(
-                content=response.aiter_bytes(),
-                status_code=response.status_code,
-                headers=dict(response.headers),
-                media_type=response.headers.get("content-type")
-            )
-
+        # Forward request to vLLM without buffering the response body
+        response = await client.send(upstream_request, stream=True)
     except httpx.RequestError as e:
-        logger.error(f"Error connecting to vLLM server: {e}")
+        logger.error("Error connecting to vLLM server: %s", e)
         raise HTTPException(
             status_code=503,
             detail=f"vLLM server unavailable: {str(e)}"
         )
 
+    async def body_iter():
+        # Release the upstream connection back to the shared pool even if the
+        # client disconnects mid-stream
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await response.aclose()
+
+    # Return streaming response
+    return StreamingResponse(
+        content=body_iter(),
+        status_code=response.status_code,
+        headers={k: v for k, v in response.headers.items() if k.lower() not in _HOP_BY_HOP},
+        media_type=response.headers.get("content-type"),
+    )
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -116,9 +170,18 @@ if __name__ == "__main__":
     logger.info(f"Starting API Gateway on port {port}")
     logger.info(f"Proxying to vLLM at {VLLM_BASE_URL}")
 
+    # Single worker by default: Cloud Run instances serve one request at a time and
+    # extra processes would compete with vLLM for CPU during cold start.
+    # Each worker runs its own lifespan, so every worker gets its own HTTP client
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    logger.info(f"Starting {workers} worker(s)")
+
     uvicorn.run(
-        app,
+        "api_gateway:app",
         host="0.0.0.0",
         port=port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
         log_level="info"
     )
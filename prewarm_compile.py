@@ -13,8 +13,8 @@ the same container instance, while still benefiting from torch.compile optimizat
 import os
 import sys
 import time
-import requests
-from typing import List
+import httpx
+from typing import Dict, List, Optional
 
 # Configuration
 # MODEL_REPO is the Hugging Face model identifier
@@ -53,25 +53,32 @@ def wait_for_server_ready(max_wait: int = SERVER_STARTUP_TIMEOUT) -> bool:
     start_time = time.time()
     models_endpoint = f"{BASE_URL}/v1/models"
     poll_count = 0
-
-    while time.time() - start_time < max_wait:
-        poll_count += 1
-        try:
-            response = requests.get(models_endpoint, timeout=5)
-            if response.status_code == 200:
-                elapsed = time.time() - start_time
-                print(f"[Pre-warm] Server is ready! (took {elapsed:.1f}s, {poll_count} polls)", flush=True)
-                print(f"[Pre-warm] [TIMING] Server readiness check completed: {elapsed:.2f}s", flush=True)
-                return True
-        except requests.exceptions.RequestException:
-            pass
-
-        # Log progress every 10 seconds
-        if poll_count % 5 == 0:
-            elapsed = time.time() - start_time
-            print(f"[Pre-warm] Still waiting... ({elapsed:.1f}s elapsed, {poll_count} polls)", flush=True)
-
-        time.sleep(2)
+    # Poll quickly at first, then back off exponentially (capped) while vLLM loads
+    delay = 0.25
+    last_progress_log = start_time
+
+    # Reuse one client so polls share a keep-alive connection once the server is up
+    with httpx.Client(timeout=5) as client:
+        while time.time() - start_time < max_wait:
+            poll_count += 1
+            try:
+                response = client.get(models_endpoint)
+                if response.status_code == 200:
+                    elapsed = time.time() - start_time
+                    print(f"[Pre-warm] Server is ready! (took {elapsed:.1f}s, {poll_count} polls)", flush=True)
+                    print(f"[Pre-warm] [TIMING] Server readiness check completed: {elapsed:.2f}s", flush=True)
+                    return True
+            except httpx.RequestError:
+                pass
+
+            # Log progress every 10 seconds
+            now = time.time()
+            if now - last_progress_log >= 10:
+                last_progress_log = now
+                print(f"[Pre-warm] Still waiting... ({now - start_time:.1f}s elapsed, {poll_count} polls)", flush=True)
+
+            time.sleep(delay)
+            delay = min(delay * 1.5, 5.0)
 
     elapsed = time.time() - start_time
     print(f"[Pre-warm] ERROR: Server did not become ready within {max_wait}s", flush=True)
@@ -79,24 +86,53 @@ def wait_for_server_ready(max_wait: int = SERVER_STARTUP_TIMEOUT) -> bool:
     return False
 
 
-def generate_prompt_of_length(target_tokens: int) -> str:
+def load_tokenizer() -> Optional[object]:
+    """
+    Load the served model's tokenizer so prompts can be sized in real tokens.
+
+    Returns:
+        The tokenizer, or None if it cannot be loaded (prompts then fall back
+        to the character-based heuristic)
+    """
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(
+            os.environ.get('MODEL_PATH', MODEL_REPO),
+            trust_remote_code=True
+        )
+    except Exception as e:
+        print(f"[Pre-warm] Tokenizer unavailable, using ~4 chars/token heuristic: {e}", flush=True)
+        return None
+
+
+def generate_prompt_of_length(target_tokens: int, tokenizer: Optional[object] = None) -> str:
     """
     Generate a prompt that's approximately the target number of tokens.
 
-    Uses repetition of a simple phrase. Rough approximation: 1 token ≈ 4 characters.
+    Uses repetition of a simple phrase. With a tokenizer the phrase's token IDs are
+    repeated, truncated to target_tokens and decoded, which lands close to the
+    target: re-encoding may differ by a token or so at the cut, and vLLM adds any
+    special tokens (e.g. BOS) on top. Without one, the rough approximation
+    1 token ≈ 4 characters is used.
 
     Args:
         target_tokens: Approximate number of tokens desired
+        tokenizer: Optional tokenizer of the served model
 
     Returns:
         Generated prompt string
     """
+    # Use a simple repeating pattern
+    base_phrase = "The quick brown fox jumps over the lazy dog. "
+
+    if tokenizer is not None:
+        phrase_ids = tokenizer.encode(base_phrase, add_special_tokens=False)
+        token_ids = phrase_ids * (target_tokens // len(phrase_ids) + 1)
+        return tokenizer.decode(token_ids[:target_tokens])
+
     # Rough heuristic: 1 token ≈ 4 characters for English text
     chars_per_token = 4
     target_chars = target_tokens * chars_per_token
-
-    # Use a simple repeating pattern
-    base_phrase = "The quick brown fox jumps over the lazy dog. "
     repetitions = (target_chars // len(base_phrase)) + 1
     prompt = base_phrase * repetitions
 
@@ -104,11 +140,27 @@ def generate_prompt_of_length(target_tokens: int) -> str:
     return prompt[:target_chars]
 
 
-def prewarm_request(prompt_length: int, request_num: int, total_requests: int) -> bool:
+def build_prompts(prompt_lengths: List[int]) -> Dict[int, str]:
+    """
+    Build the pre-warming prompt for each target length once.
+
+    Args:
+        prompt_lengths: List of prompt lengths to pre-warm
+
+    Returns:
+        Mapping of prompt length (tokens) to prompt string
+    """
+    tokenizer = load_tokenizer()
+    return {length: generate_prompt_of_length(length, tokenizer) for length in prompt_lengths}
+
+
+def prewarm_request(client: httpx.Client, prompt: str, prompt_length: int, request_num: int, total_requests: int) -> bool:
     """
     Make a single pre-warming request for a specific input length.
 
     Args:
+        client: Shared HTTP client used for all pre-warming requests
+        prompt: Pre-built prompt of roughly prompt_length tokens
         prompt_length: Target prompt length in tokens
         request_num: Current request number (1-indexed)
         total_requests: Total number of requests
@@ -116,8 +168,6 @@ def prewarm_request(prompt_length: int, request_num: int, total_requests: int) -
     Returns:
         True if successful, False otherwise
     """
-    prompt = generate_prompt_of_length(prompt_length)
-
     payload = {
         "model": MODEL_ID,
         "prompt": prompt,
@@ -129,11 +179,7 @@ def prewarm_request(prompt_length: int, request_num: int, total_requests: int) -
     start_time = time.time()
 
     try:
-        response = requests.post(
-            COMPLETIONS_ENDPOINT,
-            json=payload,
-            timeout=PREWARM_REQUEST_TIMEOUT
-        )
+        response = client.post(COMPLETIONS_ENDPOINT, json=payload)
         elapsed = time.time() - start_time
 
         if response.status_code == 200:
@@ -146,41 +192,47 @@ def prewarm_request(prompt_length: int, request_num: int, total_requests: int) -
             print(f"[Pre-warm]   Response: {response.text[:200]}", flush=True)
             return False
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         elapsed = time.time() - start_time
         print(f"[Pre-warm] [{request_num}/{total_requests}] ✗ Request timed out", flush=True)
         print(f"[Pre-warm] [TIMING] Request {request_num} ({prompt_length} tokens): {elapsed:.2f}s (TIMEOUT)", flush=True)
         return False
-    except requests.exceptions.RequestException as e:
+    except httpx.RequestError as e:
         elapsed = time.time() - start_time
         print(f"[Pre-warm] [{request_num}/{total_requests}] ✗ Request failed with exception: {e}", flush=True)
         print(f"[Pre-warm] [TIMING] Request {request_num} ({prompt_length} tokens): {elapsed:.2f}s (ERROR)", flush=True)
         return False
 
 
-def run_prewarming(prompt_lengths: List[int]) -> int:
+def run_prewarming(prompts: Dict[int, str]) -> int:
     """
     Run pre-warming for all specified prompt lengths.
 
+    Requests are sent one at a time so each prompt length is prefilled on its own;
+    concurrent requests would be co-batched by the vLLM scheduler and the
+    individual shapes would never be compiled. A single client is reused so the
+    requests share one keep-alive connection.
+
     Args:
-        prompt_lengths: List of prompt lengths to pre-warm
+        prompts: Mapping of prompt length (tokens) to pre-built prompt
 
     Returns:
         Number of successful pre-warming requests
     """
+    prompt_lengths = list(prompts)
     print(f"[Pre-warm] Starting torch.compile pre-warming for {len(prompt_lengths)} input shapes", flush=True)
     print(f"[Pre-warm] Target prompt lengths (tokens): {prompt_lengths}", flush=True)
     print(f"[Pre-warm] [TIMING] Starting pre-warming requests...", flush=True)
 
     overall_start = time.time()
-    successful = 0
     total_requests = len(prompt_lengths)
 
-    for idx, length in enumerate(prompt_lengths, start=1):
-        if prewarm_request(length, idx, total_requests):
-            successful += 1
-        # Small delay between requests
-        time.sleep(1)
+    successful = 0
+
+    with httpx.Client(timeout=PREWARM_REQUEST_TIMEOUT) as client:
+        for idx, length in enumerate(prompt_lengths, start=1):
+            if prewarm_request(client, prompts[length], length, idx, total_requests):
+                successful += 1
 
     overall_elapsed = time.time() - overall_start
     print(f"[Pre-warm] Pre-warming complete: {successful}/{len(prompt_lengths)} successful", flush=True)
@@ -215,6 +267,9 @@ def main() -> int:
     print(f"[Pre-warm] Server: {BASE_URL}", flush=True)
     print(f"[Pre-warm] torch.compile level: {compile_level}", flush=True)
 
+    # Build prompts up front; this overlaps with the vLLM server starting up
+    prompts = build_prompts(PREWARM_LENGTHS)
+
     # Wait for server to be ready
     if not wait_for_server_ready():
         print("[Pre-warm] ERROR: Server failed to start, cannot run pre-warming", flush=True)
@@ -223,7 +278,7 @@ def main() -> int:
         return 0
 
     # Run pre-warming
-    successful = run_prewarming(PREWARM_LENGTHS)
+    successful = run_prewarming(prompts)
 
     if successful == 0:
         print("[Pre-warm] WARNING: No pre-warming requests succeeded", flush=True)
@@ -0,0 +1,189 @@
+
+# Offline tests for the API gateway proxy. The app is driven in-process through
+# httpx.ASGITransport, with vLLM replaced by an httpx.MockTransport upstream.
+import asyncio
+
+import httpx
+import pytest
+from starlette.requests import ClientDisconnect
+
+import api_gateway
+
+
+class TrackingStream(httpx.AsyncByteStream):
+    """Upstream response body that records whether it was closed."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.fixture
+def upstream():
+    """
+    Installs a mock vLLM upstream on the gateway and records what it receives.
+    """
+    received = []
+    streams = []
+
+    async def handler(request):
+        body = await request.aread()
+        received.append((request, body))
+        stream = TrackingStream([b'data: {"text": "Par"}\n\n', b'data: {"text": "is"}\n\n'])
+        streams.append(stream)
+        return httpx.Response(
+            200,
+            headers={
+                "content-type": "text/event-stream",
+                "connection": "keep-alive",
+                "keep-alive": "timeout=5",
+                "x-upstream": "vllm",
+            },
+            stream=stream,
+        )
+
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler), base_url=api_gateway.VLLM_BASE_URL
+    )
+    api_gateway.app.state.http_client = client
+    yield received, streams
+    asyncio.run(client.aclose())
+    del api_gateway.app.state.http_client
+
+
+def send(method, path, **kwargs):
+    """
+    Sends a request to the gateway app in-process and returns the buffered response.
+    """
+    async def run():
+        transport = httpx.ASGITransport(app=api_gateway.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            return await client.request(method, path, **kwargs)
+
+    return asyncio.run(run())
+
+
+def test_strips_hop_by_hop_request_headers(upstream):
+    """
+    Tests that X-API-Key and hop-by-hop headers are not forwarded to vLLM.
+    """
+    received, _ = upstream
+    response = send("GET", "/v1/models", headers={
+        "x-api-key": "sk-secret",
+        "connection": "upgrade",
+        "te": "trailers",
+        "authorization": "Bearer token",
+    })
+
+    assert response.status_code == 200
+    forwarded = received[0][0].headers
+    for name in ("x-api-key", "te", "transfer-encoding"):
+        assert name not in forwarded, f"'{name}' was forwarded upstream."
+    # The shared upstream client manages its own Connection header
+    assert forwarded.get("connection") != "upgrade", "Client 'connection' header was forwarded upstream."
+    assert forwarded["authorization"] == "Bearer token"
+    assert received[0][1] == b"", "Bodiless request was forwarded with a body."
+
+
+def test_forwards_request_body_intact(upstream):
+    """
+    Tests that a streamed request body reaches vLLM unchanged and unchunked.
+    """
+    received, _ = upstream
+    payload = b'{"model": "m", "prompt": "' + b"x" * 100_000 + b'"}'
+    response = send("POST", "/v1/completions?echo=1", content=payload,
+                    headers={"content-type": "application/json"})
+
+    assert response.status_code == 200
+    request, body = received[0]
+    assert body == payload, "Request body was altered in transit."
+    assert request.headers["content-length"] == str(len(payload))
+    assert "transfer-encoding" not in request.headers
+    assert request.url.path == "/v1/completions"
+    assert request.url.params["echo"] == "1"
+
+
+def test_streams_response_and_closes_upstream(upstream):
+    """
+    Tests that the upstream body is streamed back verbatim, hop-by-hop response
+    headers are dropped, and the upstream response is closed afterwards.
+    """
+    _, streams = upstream
+    response = send("POST", "/v1/completions", json={"model": "m", "prompt": "p"})
+
+    assert response.status_code == 200
+    assert response.content == b'data: {"text": "Par"}\n\ndata: {"text": "is"}\n\n'
+    assert response.headers["x-upstream"] == "vllm"
+    assert "keep-alive" not in response.headers
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert streams[0].closed, "Upstream response was not closed after streaming."
+
+
+def test_closes_upstream_when_client_disconnects(upstream):
+    """
+    Tests that the upstream response is closed when the client goes away mid-stream.
+    """
+    _, streams = upstream
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+        if message["type"] == "http.response.body" and message.get("body"):
+            raise OSError("client disconnected")
+
+    async def run():
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.4"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/v1/models",
+            "raw_path": b"/v1/models",
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"host", b"gateway")],
+            "client": ("127.0.0.1", 1234),
+            "server": ("gateway", 80),
+        }
+        with pytest.raises(ClientDisconnect):
+            await api_gateway.app(scope, receive, send)
+        # Let the event loop finalize the abandoned body iterator
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    asyncio.run(run())
+
+    body_messages = [m for m in sent if m["type"] == "http.response.body"]
+    assert len(body_messages) == 1, "Streaming continued after the client disconnected."
+    assert streams[0].closed, "Upstream response was not closed after the client disconnected."
+
+
+def test_upstream_unavailable_returns_503():
+    """
+    Tests that connection errors to vLLM surface as 503.
+    """
+    def handler(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler), base_url=api_gateway.VLLM_BASE_URL
+    )
+    api_gateway.app.state.http_client = client
+    try:
+        response = send("GET", "/v1/models")
+    finally:
+        asyncio.run(client.aclose())
+        del api_gateway.app.state.http_client
+
+    assert response.status_code == 503
@@ -1,25 +1,47 @@
 
+# Run the tests serially: test_models_endpoint retries through a Cloud Run cold
+# start and so acts as the readiness gate for the (non-retried) completions POST.
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import logging
 import os
+import stat
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import subprocess
+import tempfile
 import pytest
 
+try:
+    import google.auth
+    from google.api_core.exceptions import GoogleAPIError
+    from google.auth.exceptions import GoogleAuthError
+    from google.auth.transport.requests import Request as GoogleAuthRequest
+    from google.cloud import run_v2
+    from google.oauth2 import credentials as google_user_credentials
+    from google.oauth2 import id_token as google_id_token
+except ImportError:  # Google Cloud client libraries not installed; use the gcloud CLI
+    run_v2 = None
+
+logger = logging.getLogger(__name__)
+
 # Load configuration from config.env
+@functools.cache
 def load_config():
-    """Load configuration from config.env file."""
-    config = {}
+    """Load configuration from config.env file (parsed once and cached)."""
     config_path = os.path.join(os.path.dirname(__file__), 'config.env')
-    if os.path.exists(config_path):
-        with open(config_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                # Skip comments and empty lines
-                if line and not line.startswith('#'):
-                    if '=' in line:
-                        key, value = line.split('=', 1)
-                        config[key.strip()] = value.strip()
-    return config
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, 'r') as f:
+        lines = [line.strip() for line in f]
+    # Skip comments and empty lines
+    pairs = (line.split('=', 1) for line in lines if line and not line.startswith('#') and '=' in line)
+    return {key.strip(): value.strip() for key, value in pairs}
 
 config = load_config()
 SERVICE_NAME = config.get('SERVICE_NAME', 'vllm-deepseek-r1-1-5b')
@@ -28,107 +50,322 @@ MODEL_NAME = config.get('MODEL_NAME', 'deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B
 MODEL_ID = MODEL_NAME.split('/')[-1] if '/' in MODEL_NAME else MODEL_NAME
 REGION = "us-central1"
 
-@pytest.fixture(scope="module")
-def service_url():
+# Identity tokens are valid for 1 hour; cache them per audience (service URL) in a
+# private per-user directory so repeated pytest runs can skip minting a new one
+TOKEN_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'vllm-container-ngc', 'id-tokens'
+)
+# Don't reuse a cached token that expires within this many seconds
+TOKEN_EXPIRY_MARGIN = 120
+
+# Connection errors, timeouts, rate limiting and gateway errors (e.g. while a cold Cloud Run
+# instance starts) are retried with capped exponential backoff plus jitter, so
+# parallel CI jobs polling the same revision don't retry in lockstep. Retry-After
+# headers are honored. Only GETs are retried, never completion POSTs.
+RETRY = Retry(
+    total=5,
+    backoff_factor=1.0,
+    backoff_max=30.0,
+    backoff_jitter=1.0,
+    status_forcelist=(408, 429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+def token_claims(token):
+    """Decode a JWT's payload claims (signature not verified), or None if malformed."""
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return None
+    return claims if isinstance(claims, dict) else None
+
+def token_usable_for(token, audience):
     """
-    Retrieves the Cloud Run service URL.
-    First checks SERVICE_URL environment variable, then falls back to gcloud.
+    Check that an identity token is not about to expire and, if it is bound to a
+    URL audience (service account tokens), that it was issued for this service.
+    User tokens from gcloud carry the OAuth client ID as audience instead.
     """
-    # Check for environment variable first
-    env_url = os.environ.get('SERVICE_URL')
-    if env_url:
-        print(f"Using SERVICE_URL from environment: {env_url}")
-        return env_url
+    claims = token_claims(token)
+    if claims is None or not isinstance(claims.get('exp'), (int, float)):
+        return False
+    if claims['exp'] - time.time() < TOKEN_EXPIRY_MARGIN:
+        return False
+    aud = claims.get('aud')
+    if isinstance(aud, str) and aud.startswith(('http://', 'https://')):
+        return aud.rstrip('/') == audience.rstrip('/')
+    return True
 
-    # Fall back to gcloud
+def token_cache_path(audience):
+    """
+    Return the cache file for an audience, or None if the cache directory can't be
+    trusted (not a directory, or on POSIX not owned by / private to this user).
+    """
+    try:
+        os.makedirs(TOKEN_CACHE_DIR, mode=0o700, exist_ok=True)
+        st = os.lstat(TOKEN_CACHE_DIR)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode):
+        return None
+    if hasattr(os, 'getuid') and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+        return None
+    key = hashlib.sha256(audience.rstrip('/').encode()).hexdigest()
+    return os.path.join(TOKEN_CACHE_DIR, f"{key}.jwt")
+
+def read_cached_token(audience):
+    """Return a cached identity token for the audience, or None if missing or unusable."""
+    path = token_cache_path(audience)
+    if path is None:
+        return None
+    try:
+        with open(path, 'r') as f:
+            token = f.read().strip()
+    except OSError:
+        return None
+    return token if token_usable_for(token, audience) else None
+
+def write_cached_token(audience, token):
+    """Cache an identity token for the audience, if it can be validated on reuse."""
+    if not token_usable_for(token, audience):
+        return
+    path = token_cache_path(audience)
+    if path is None:
+        return
+    try:
+        # mkstemp creates a fresh 0600 file (O_EXCL); rename it into place atomically
+        fd, tmp_path = tempfile.mkstemp(dir=TOKEN_CACHE_DIR)
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(token)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def clear_cached_token(audience):
+    """Drop the cached identity token for the audience (e.g. after a 401)."""
+    path = token_cache_path(audience)
+    if path is not None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+@functools.cache
+def google_credentials():
+    """Load Application Default Credentials and project (once per session)."""
+    return google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+
+def sdk_service_url():
+    """
+    Look up the Cloud Run service URL in-process with the Cloud Run client library.
+
+    Returns:
+        The service URL, or None if it could not be resolved
+    """
+    try:
+        credentials, project = google_credentials()
+        if not project:
+            return None
+        client = run_v2.ServicesClient(credentials=credentials)
+        service = client.get_service(name=f"projects/{project}/locations/{REGION}/services/{SERVICE_NAME}")
+        return service.uri or None
+    except (GoogleAuthError, GoogleAPIError) as e:
+        logger.warning("Google Cloud SDK service lookup failed, falling back to gcloud: %s", e)
+        return None
+
+def sdk_id_token(audience):
+    """
+    Mint an identity token for the service in-process with google-auth.
+
+    Returns:
+        The identity token, or None if it could not be obtained
+    """
     try:
-        command = [
+        credentials, _ = google_credentials()
+        auth_request = GoogleAuthRequest()
+        if isinstance(credentials, google_user_credentials.Credentials):
+            # User credentials carry an ID token once refreshed. Checked first so dev
+            # machines don't wait on fetch_id_token probing the GCE metadata server.
+            if not credentials.valid:
+                credentials.refresh(auth_request)
+            return credentials.id_token
+        # Service account / metadata server credentials mint an ID token for the service
+        return google_id_token.fetch_id_token(auth_request, audience)
+    except GoogleAuthError as e:
+        logger.warning("Google Cloud SDK token lookup failed, falling back to gcloud: %s", e)
+        return None
+
+async def run_gcloud(command):
+    """Run a gcloud command and return its stripped stdout."""
+    process = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+    # gcloud prints a URL or a JWT here, both plain ASCII
+    return stdout.decode("ascii").strip()
+
+async def run_gcloud_commands(commands):
+    """
+    Run gcloud commands concurrently.
+
+    Returns:
+        Dict mapping each command's name to its output, or to the
+        CalledProcessError / FileNotFoundError it failed with
+    """
+    results = await asyncio.gather(*(run_gcloud(command) for command in commands.values()),
+                                   return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(
+                result, (subprocess.CalledProcessError, FileNotFoundError)):
+            raise result
+    return dict(zip(commands, results))
+
+@pytest.fixture(scope="session")
+def _gcloud_bootstrap():
+    """
+    Resolve the Cloud Run service URL and authentication token.
+    SERVICE_URL / AUTH_TOKEN environment variables take precedence, then a token
+    cached for this service URL by a previous run. Anything still missing is looked
+    up with the Google Cloud client libraries when installed, then with gcloud,
+    running both gcloud commands concurrently.
+
+    The client library path resolves the URL and then the token sequentially (the
+    token's audience is the URL). It is taken whenever the libraries are installed,
+    as on CI, so the concurrent gcloud lookups only run as a fallback.
+
+    Returns:
+        Tuple of (service URL, auth token)
+    """
+    url = os.environ.get('SERVICE_URL')
+    if url:
+        logger.info("Using SERVICE_URL from environment: %s", url)
+
+    token = os.environ.get('AUTH_TOKEN')
+    if token:
+        logger.info("Using AUTH_TOKEN from environment")
+
+    if not url and run_v2 is not None:
+        url = sdk_service_url()
+
+    # Cached tokens are keyed by audience, so they can only be used once the URL is known
+    if url and not token:
+        token = read_cached_token(url)
+        if not token and run_v2 is not None:
+            token = sdk_id_token(url)
+            if token:
+                write_cached_token(url, token)
+
+    commands = {}
+    if not url:
+        commands['url'] = [
             "gcloud", "run", "services", "describe",
             SERVICE_NAME,
             "--platform", "managed",
             "--region", REGION,
             "--format", "value(status.url)"
         ]
-        process = subprocess.run(command, capture_output=True, text=True, check=True)
-        url = process.stdout.strip()
+    if not token:
+        commands['token'] = ["gcloud", "auth", "print-identity-token"]
+    if not commands:
+        return url, token
+
+    # Fall back to gcloud
+    results = asyncio.run(run_gcloud_commands(commands))
+
+    if 'url' in results:
+        url = results['url']
+        if isinstance(url, Exception):
+            pytest.fail(f"Error retrieving service URL: {url}. "
+                       f"Install gcloud CLI or set SERVICE_URL environment variable.")
         if not url:
             pytest.fail("Failed to retrieve Cloud Run service URL.")
-        return url
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
-        pytest.fail(f"Error retrieving service URL: {e}. "
-                   f"Install gcloud CLI or set SERVICE_URL environment variable.")
-
-@pytest.fixture(scope="module")
-def auth_token():
-    """
-    Get authentication token for Cloud Run.
-    First checks AUTH_TOKEN environment variable, then falls back to gcloud.
-    """
-    # Check for environment variable first
-    env_token = os.environ.get('AUTH_TOKEN')
-    if env_token:
-        print(f"Using AUTH_TOKEN from environment")
-        return env_token
 
-    # Fall back to gcloud
-    try:
-        command = ["gcloud", "auth", "print-identity-token"]
-        process = subprocess.run(command, capture_output=True, text=True, check=True)
-        token = process.stdout.strip()
+    if 'token' in results:
+        token = results['token']
+        if isinstance(token, Exception):
+            pytest.fail(f"Error retrieving auth token: {token}. "
+                       f"Install gcloud CLI or set AUTH_TOKEN environment variable.")
         if not token:
             pytest.fail("Failed to retrieve authentication token.")
-        return token
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
-        pytest.fail(f"Error retrieving auth token: {e}. "
-                   f"Install gcloud CLI or set AUTH_TOKEN environment variable.")
+        write_cached_token(url, token)
+
+    return url, token
+
+@pytest.fixture(scope="session")
+def service_url(_gcloud_bootstrap):
+    """Retrieves the Cloud Run service URL."""
+    return _gcloud_bootstrap[0]
+
+@pytest.fixture(scope="session")
+def auth_token(_gcloud_bootstrap):
+    """Get authentication token for Cloud Run."""
+    return _gcloud_bootstrap[1]
 
-def test_models_endpoint(service_url, auth_token):
+@pytest.fixture(scope="session")
+def http(auth_token):
+    """
+    Authenticated HTTP session shared by all tests, so requests to the service
+    reuse the same keep-alive TCP/TLS connection.
+    """
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {auth_token}"
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=RETRY)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    yield session
+    session.close()
+
+# Overall budget covers fixture setup and every retry, not just a single request;
+# sized to ride out one Cloud Run cold start
+@pytest.mark.timeout(180)
+def test_models_endpoint(service_url, http):
     """
     Tests the /v1/models endpoint.
     """
     endpoint_url = f"{service_url}/v1/models"
-    headers = {"Authorization": f"Bearer {auth_token}"}
-    print(f"Pinging model endpoint: {endpoint_url}")
+    logger.info("Pinging model endpoint: %s", endpoint_url)
 
-    for i in range(5):
-        try:
-            response = requests.get(endpoint_url, headers=headers, timeout=30)
-            print(f"Attempt {i+1}: Received HTTP status: {response.status_code}")
-            if response.status_code == 200:
-                break
-        except requests.exceptions.RequestException as e:
-            print(f"Attempt {i+1}: Request failed: {e}")
-        time.sleep(10)
-    else:
-        pytest.fail("Health check failed after multiple attempts.")
+    try:
+        response = http.get(endpoint_url, timeout=30)
+    except requests.exceptions.RequestException as e:
+        pytest.fail(f"Health check failed after multiple attempts: {e}")
+    logger.info("Received HTTP status: %d", response.status_code)
+    if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+        # Client errors (bad credentials, wrong service or path) won't fix themselves
+        if response.status_code == 401:
+            # Don't keep failing on a rejected cached token in later runs
+            clear_cached_token(service_url)
+        pytest.fail(f"Unrecoverable {response.status_code}: {response.text[:200]}")
 
     assert response.status_code == 200, "Endpoint did not return status 200."
 
     response_body = response.json()
-    print(f"Response body: {response_body}")
+    logger.info("Response body: %s", response_body)
     assert "data" in response_body, "Response body does not contain 'data' key."
-    model_ids = [model["id"] for model in response_body["data"]]
-    assert MODEL_ID in model_ids, f"Model '{MODEL_ID}' not found in response."
+    assert any(model.get("id") == MODEL_ID for model in response_body["data"]), \
+        f"Model '{MODEL_ID}' not found in response."
 
-def test_completions_endpoint(service_url, auth_token):
+def check_completion(service_url, http, payload):
     """
-    Tests the /v1/completions endpoint.
+    Sends a completions request and checks that it generated text.
     """
     completions_url = f"{service_url}/v1/completions"
-    headers = {"Authorization": f"Bearer {auth_token}"}
-    print(f"Testing completions endpoint: {completions_url}")
+    logger.info("Testing completions endpoint: %s", completions_url)
 
-    payload = {
-        "model": MODEL_ID,
-        "prompt": "What is the capital of France?",
-        "max_tokens": 50,
-        "temperature": 0.7
-    }
-
-    response = requests.post(completions_url, json=payload, headers=headers, timeout=60)
-    print(f"Completions response: {response.text}")
-
-    assert response.status_code == 200, "Completions endpoint returned non-200 status."
+    response = http.post(completions_url, json=payload, timeout=60)
+    if response.status_code != 200:
+        pytest.fail(f"Completions endpoint returned {response.status_code}: {response.text[:500]}")
 
     response_json = response.json()
     assert "choices" in response_json, "'choices' key not found in completions response."
@@ -136,3 +373,29 @@ def test_completions_endpoint(service_url, auth_token):
     assert "text" in response_json["choices"][0], "'text' key not found in the first choice."
     assert len(response_json["choices"][0]["text"]) > 0, "Generated text is empty."
 
+@pytest.mark.timeout(120)
+def test_completions_endpoint_smoke(service_url, http):
+    """
+    Smoke-tests the /v1/completions endpoint with a minimal, deterministic generation.
+    Decode time grows with max_tokens, so only a few tokens are requested.
+    """
+    check_completion(service_url, http, {
+        "model": MODEL_ID,
+        "prompt": "What is the capital of France?",
+        "max_tokens": 4,
+        "temperature": 0.0,
+        "seed": 42  # Greedy + fixed seed keeps output reproducible across runs
+    })
+
+@pytest.mark.slow
+def test_completions_endpoint_long(service_url, http):
+    """
+    Tests the /v1/completions endpoint with a longer sampled generation.
+    Deselected by default; run with: pytest -m slow test_endpoint.py
+    """
+    check_completion(service_url, http, {
+        "model": MODEL_ID,
+        "prompt": "What is the capital of France?",
+        "max_tokens": 50,
+        "temperature": 0.7
+    })